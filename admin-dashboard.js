@@ -98,32 +98,54 @@ function togglePasswordVisibility(inputId, icon) {
 //  QUEUE LOGIC 
 // ==========================================
 
-// [UPDATED] Silent Queue Load
-async function loadQueue() {
-    const container = document.getElementById('queue-display-area');
-    // Removed "Loading..." text to prevent blinking
+// [UPDATED] Server-side queue: Urgent first, then date/time.
+// The server only sends items when the queue version changed.
+let queueVersion = null;
+let queueTotal = 0;
 
+async function loadQueue() {
     try {
-        const response = await fetch(`${API_URL}/appointments`, {
+        const url = queueVersion === null ? `${API_URL}/queue` : `${API_URL}/queue?version=${queueVersion}`;
+        const response = await fetch(url, {
             headers: { 'Authorization': `Bearer ${token}` }
         });
         const data = await response.json();
+        if (!response.ok || data.unchanged) return;
 
-        let queue = data.filter(a => a.status === 'approved');
+        queueVersion = data.version;
+        queueTotal = data.total;
+        renderQueue(data.items);
 
-        queue.sort((a, b) => {
-            const dateA = new Date(a.appointment_date + 'T' + a.appointment_time);
-            const dateB = new Date(b.appointment_date + 'T' + b.appointment_time);
-            return dateA - dateB;
-        });
-
-        renderQueue(queue);
+    } catch (e) {
+        console.error(e);
+    }
+}
 
+// Claim an item before acting on it so two nurses don't handle the same visit
+async function claimQueueItem(id) {
+    try {
+        const response = await fetch(`${API_URL}/queue/${id}/claim`, {
+            method: 'POST',
+            headers: { 'Authorization': `Bearer ${token}` }
+        });
+        if (response.ok) return true;
+        const data = await response.json();
+        Swal.fire('Unavailable', data.detail || 'This appointment is no longer in the queue.', 'warning');
+        loadQueue();
+        return false;
     } catch (e) {
         console.error(e);
+        return false;
     }
 }
 
+function releaseQueueItem(id) {
+    fetch(`${API_URL}/queue/${id}/claim`, {
+        method: 'DELETE',
+        headers: { 'Authorization': `Bearer ${token}` }
+    }).catch(e => console.error(e));
+}
+
 function renderQueue(queue) {
     const container = document.getElementById('queue-display-area');
     
@@ -149,9 +171,11 @@ function renderQueue(queue) {
             <div class="hero-time">${niceTime}</div>
             
             <div class="hero-name">
-                <span style="opacity:0.6; font-size:0.7em;">#${nextPatient.id}</span><br>
+                <span style="opacity:0.6; font-size:0.7em;">#${nextPatient.id}</span>
+                ${nextPatient.urgency === 'Urgent' ? '<span style="color:#e74c3c; font-size:0.6em;"> URGENT</span>' : ''}<br>
                 ${nextPatient.student_name}
             </div>
+            ${nextPatient.claimed_by ? `<div style="color:#f39c12; margin-bottom:10px;"><i class="fas fa-user-nurse"></i> Being handled by ${nextPatient.claimed_by}</div>` : ''}
             
             <div class="hero-details">
                 <i class="fas fa-calendar-day"></i> ${niceDate} &nbsp;|&nbsp; 
@@ -174,12 +198,12 @@ function renderQueue(queue) {
     `;
 
     if (waitingList.length > 0) {
-        html += `<div class="queue-list-header">Up Next (${waitingList.length})</div>`;
+        html += `<div class="queue-list-header">Up Next (${queueTotal - 1})</div>`;
         waitingList.forEach(apt => {
             html += `
                 <div class="queue-item">
                     <div>
-                        <h4><span style="color:#999; font-size:0.9em; font-weight:normal;">#${apt.id}</span> ${apt.student_name}</h4>
+                        <h4><span style="color:#999; font-size:0.9em; font-weight:normal;">#${apt.id}</span> ${apt.student_name}${apt.urgency === 'Urgent' ? ' <span style="color:#e74c3c; font-size:0.8em;">URGENT</span>' : ''}</h4>
                         <p>${apt.service_type} • ${formatDate(apt.appointment_date)}</p>
                         <p style="font-size: 0.85rem; color: #666; margin-top: 2px;"><em>"${apt.reason}"</em></p>
                     </div>
@@ -193,7 +217,8 @@ function renderQueue(queue) {
 
     container.innerHTML = html;
 }
-function handleNoShow(id) {
+async function handleNoShow(id) {
+    if (!(await claimQueueItem(id))) return;
     Swal.fire({
         title: 'Mark as No Show?',
         text: "This will remove the time restriction and allow others to book.",
@@ -203,13 +228,17 @@ function handleNoShow(id) {
         confirmButtonText: 'Yes, No Show'
     }).then(async (result) => {
         if (result.isConfirmed) {
-            await updateStatus(id, 'noshow', 'Student did not appear for appointment.');
-            loadQueue(); 
+            // renew the claim first, the dialog may have outlived the lease
+            if (await claimQueueItem(id)) await updateStatus(id, 'noshow', 'Student did not appear for appointment.');
+        } else {
+            releaseQueueItem(id);
         }
+        loadQueue(); 
     });
 }
 
-function handleCompleteQueue(id) {
+async function handleCompleteQueue(id) {
+    if (!(await claimQueueItem(id))) return;
     Swal.fire({
         title: 'Complete Visit',
         input: 'textarea',
@@ -227,25 +256,38 @@ function handleCompleteQueue(id) {
             // Use the text they typed, or a default message if empty
             const note = result.value || 'Medical consultation completed.';
             
-            await updateStatus(id, 'completed', note);
+            // renew the claim first, typing the diagnosis may have outlived the lease
+            if (await claimQueueItem(id)) await updateStatus(id, 'completed', note);
             
             // Reload to update UI
             loadQueue(); 
             loadAppointments();
+        } else {
+            releaseQueueItem(id);
         }
     });
 }
 
 async function updateStatus(id, status, note) {
     try {
-        await fetch(`${API_URL}/appointments/${id}`, {
+        const response = await fetch(`${API_URL}/appointments/${id}`, {
             method: 'PUT',
             headers: { 'Content-Type': 'application/json', 'Authorization': `Bearer ${token}` },
             body: JSON.stringify({ status: status, admin_note: note })
         });
+        if (!response.ok) {
+            const data = await response.json();
+            Swal.fire('Not Saved', data.detail || 'Could not update the appointment.', 'error');
+            return false;
+        }
         const Toast = Swal.mixin({ toast: true, position: 'top-end', showConfirmButton: false, timer: 2000 });
         Toast.fire({ icon: 'success', title: 'Status updated' });
-    } catch (e) { console.error(e); }
+        return true;
+    } catch (e) {
+        console.error(e);
+        Swal.fire('Error', 'Connection error. Please try again.', 'error');
+        return false;
+    }
 }
 
 // ==========================================
@@ -0,0 +1,105 @@
+# Benchmark for the hot path that archiving is meant to protect.
+# Seeds growing numbers of closed, past-horizon appointments for a throwaway
+# student into the configured database (DB_CONFIG in main.py), then times the
+# default GET /api/appointments query and the /api/slots load query and prints
+# EXPLAIN for both. Finally the seeded rows are moved with the real archive
+# chunk code and timed once more. Everything seeded is removed at the end.
+#
+# run from the project folder:  python bench/bench_archive_hot_path.py [sizes]
+#   e.g.  python bench/bench_archive_hot_path.py 1000,10000,100000
+
+import os
+import sys
+import time
+from datetime import timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import APPOINTMENT_ROW_SELECT, get_db, get_archive_cutoff, get_local_now, load_schedule_config, get_load_vector, _archive_chunk
+
+SIZES = [int(n) for n in sys.argv[1].split(",")] if len(sys.argv) > 1 else [1000, 10000, 50000]
+REPEAT = 3
+SEED_BATCH = 1000
+BENCH_EMAIL = "bench-archive@clinic.local"
+BENCH_REASON = "bench-archive-seed"
+
+APPOINTMENTS_QUERY = f"""SELECT {APPOINTMENT_ROW_SELECT}, u.email AS student_email
+    FROM appointments a JOIN users u ON a.student_id = u.id ORDER BY appointment_date DESC"""
+SLOTS_LOAD_QUERY = """SELECT id, appointment_time, service_type FROM appointments
+    WHERE appointment_date = %s AND status IN ('pending', 'approved')"""
+
+def best_of(fn):
+    runs = []
+    for _ in range(REPEAT):
+        started = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - started)
+    return min(runs)
+
+def seed(cursor, student_id, count, offset):
+    # closed visits spread over the year before the archive horizon
+    oldest = get_archive_cutoff() - timedelta(days=365)
+    statuses = ('completed', 'canceled', 'rejected', 'noshow')
+    for start in range(0, count, SEED_BATCH):
+        rows = [(
+            student_id, 'Medical Consultation', 'Normal', oldest + timedelta(days=i % 365),
+            f"{8 + i % 8:02d}:00:00", BENCH_REASON, statuses[i % 4],
+        ) for i in range(offset + start, offset + min(start + SEED_BATCH, count))]
+        cursor.executemany("""
+            INSERT INTO appointments (student_id, service_type, urgency, appointment_date, appointment_time, reason, status)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+        """, rows)
+
+def measure(conn, label):
+    slot_day = str(get_local_now().date() + timedelta(days=1))
+    cursor = conn.cursor()
+    dict_cursor = conn.cursor(dictionary=True)
+    try:
+        config = load_schedule_config(dict_cursor)
+
+        def appointments():
+            cursor.execute(APPOINTMENTS_QUERY)
+            cursor.fetchall()
+
+        def slots_load():
+            get_load_vector(dict_cursor, config, slot_day)
+
+        print(f"{label}: appointments list {best_of(appointments) * 1000:.1f} ms, "
+              f"slots load {best_of(slots_load) * 1000:.1f} ms (best of {REPEAT})")
+        for name, query, params in [("appointments", APPOINTMENTS_QUERY, ()), ("slots load", SLOTS_LOAD_QUERY, (slot_day,))]:
+            cursor.execute("EXPLAIN " + query, params)
+            columns = [c[0] for c in cursor.description]
+            for row in cursor.fetchall():
+                plan = dict(zip(columns, row))
+                print(f"    EXPLAIN {name}: table={plan['table']} type={plan['type']} key={plan['key']} rows={plan['rows']} extra={plan['Extra']}")
+    finally:
+        cursor.close()
+        dict_cursor.close()
+
+if __name__ == "__main__":
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("INSERT INTO users (full_name, email, password, role) VALUES ('Bench Student', %s, 'x', 'student')", (BENCH_EMAIL,))
+        student_id = cursor.lastrowid
+        conn.commit()
+
+        seeded = 0
+        for size in sorted(SIZES):
+            seed(cursor, student_id, size - seeded, seeded)
+            conn.commit()
+            seeded = size
+            measure(conn, f"{seeded} closed historical rows in appointments")
+
+        cursor.execute("SELECT id FROM appointments WHERE student_id = %s ORDER BY appointment_date, id", (student_id,))
+        ids = [row[0] for row in cursor.fetchall()]
+        for start in range(0, len(ids), SEED_BATCH):
+            _archive_chunk(cursor, ids[start:start + SEED_BATCH])
+            conn.commit()
+        measure(conn, f"after archiving those {seeded} rows")
+    finally:
+        cursor.execute("DELETE FROM appointments_archive WHERE reason = %s", (BENCH_REASON,))
+        cursor.execute("DELETE FROM users WHERE email = %s", (BENCH_EMAIL,))
+        conn.commit()
+        cursor.close()
+        conn.close()
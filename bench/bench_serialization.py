@@ -0,0 +1,58 @@
+# Microbenchmark for the appointment list response (GET /api/appointments).
+# Serializes 50k appointments the old way (dictionary cursor rows, str() loop,
+# jsonable_encoder + JSONResponse) and the new way (tuple rows already formatted
+# by MySQL, AppointmentRow + ORJSONResponse). No database needed.
+#
+# run from the project folder:  python bench/bench_serialization.py [rows]
+
+import os
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+from main import AppointmentRow
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+REPEAT = 3
+
+def old_rows():
+    created = datetime(2026, 1, 1, 8, 0, 0)
+    return [{
+        'id': i, 'student_id': 3, 'service_type': 'Medical Consultation', 'urgency': 'Normal',
+        'appointment_date': date(2026, 1, 1) + timedelta(days=i % 300), 'appointment_time': timedelta(hours=8 + i % 8),
+        'reason': 'fever and cough', 'booking_mode': 'standard', 'status': 'completed', 'admin_note': 'Given paracetamol.',
+        'created_at': created, 'updated_at': created, 'student_name': 'Juan Dela Cruz', 'student_email': 'juan@school.edu',
+    } for i in range(ROWS)]
+
+def new_rows():
+    return [(
+        i, 3, 'Medical Consultation', 'Normal',
+        (date(2026, 1, 1) + timedelta(days=i % 300)).isoformat(), f"{8 + i % 8:02d}:00:00",
+        'fever and cough', 'standard', 'completed', 'Given paracetamol.',
+        '2026-01-01T08:00:00', '2026-01-01T08:00:00', 'Juan Dela Cruz', 'juan@school.edu',
+    ) for i in range(ROWS)]
+
+def before():
+    rows = old_rows()
+    started = time.perf_counter()
+    for row in rows:
+        row['appointment_date'] = str(row['appointment_date'])
+        row['appointment_time'] = str(row['appointment_time'])
+    body = JSONResponse(jsonable_encoder(rows)).body
+    return time.perf_counter() - started, len(body)
+
+def after():
+    rows = new_rows()
+    started = time.perf_counter()
+    body = ORJSONResponse([AppointmentRow(*row) for row in rows]).body
+    return time.perf_counter() - started, len(body)
+
+if __name__ == "__main__":
+    for label, fn in [("before (dict rows + jsonable_encoder + json)", before), ("after  (slotted rows + orjson)", after)]:
+        runs = [fn() for _ in range(REPEAT)]
+        best = min(seconds for seconds, _ in runs)
+        print(f"{label}: {best:.3f}s for {ROWS} rows ({runs[0][1] / 1e6:.1f} MB), best of {REPEAT}")
@@ -1,9 +1,11 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel, EmailStr
 from typing import Optional, List, Dict
-from datetime import datetime, timedelta, time as dt_time, timezone
+from datetime import datetime, timedelta, timezone
+from dataclasses import dataclass
 import mysql.connector
 from mysql.connector import Error
 import bcrypt
@@ -12,6 +14,10 @@ import os
 import json
 import time 
 import re
+import threading
+import bisect
+import hashlib
+from cachetools import TTLCache
 import google.generativeai as genai
 from dotenv import load_dotenv
 import smtplib
@@ -159,8 +165,137 @@ def parse_relative_date(date_str):
 
     return date_str
 
-# [NEW] CENTRALIZED SLOT CALCULATOR
-def calculate_available_slots(conn, date_str):
+# --- schedule engine ---
+# Slot listing (/api/slots, chatbot) and booking validation both go through
+# these helpers, so what we offer and what we accept can never disagree.
+# Hours, staff count, closures and service durations live in the DB
+# (clinic_hours, clinic_closures, service_durations in schema.sql).
+
+SLOT_STEP_MINUTES = 30
+DEFAULT_SERVICE_MINUTES = 60
+SCHEDULE_CACHE_SECONDS = 60
+MINUTES_PER_DAY = 24 * 60
+
+# Fallback used when the schedule tables are missing or empty (old hard-coded hours)
+DEFAULT_CLINIC_HOURS = [(wd, 8 * 60, 12 * 60, 1) for wd in range(6)] + [(wd, 13 * 60, 17 * 60, 1) for wd in range(6)]
+DEFAULT_SERVICE_DURATIONS = {"Medical Consultation": 60, "Medical Clearance": 30}
+
+_schedule_lock = threading.Lock()
+_schedule_config_cache = TTLCache(maxsize=1, ttl=SCHEDULE_CACHE_SECONDS)
+_capacity_cache = TTLCache(maxsize=128, ttl=SCHEDULE_CACHE_SECONDS)
+
+def to_minutes(value):
+    # MySQL TIME columns come back as timedelta, python code uses datetime.time
+    if isinstance(value, timedelta):
+        return int(value.total_seconds()) // 60
+    return value.hour * 60 + value.minute
+
+def format_minutes(minutes):
+    h, m = divmod(minutes, 60)
+    ampm = "AM" if h < 12 else "PM"
+    display_h = h if h <= 12 else h - 12
+    display_h = 12 if display_h == 0 else display_h
+    return f"{display_h:02d}:{m:02d} {ampm}"
+
+def parse_booking_time(time_str):
+    # Accepts "09:30 AM", "09:30" and "09:30:00"
+    if "AM" in time_str.upper() or "PM" in time_str.upper():
+        return datetime.strptime(time_str.strip(), "%I:%M %p").time()
+    if len(time_str) == 5: time_str += ":00"
+    return datetime.strptime(time_str, "%H:%M:%S").time()
+
+def load_schedule_config(cursor):
+    with _schedule_lock:
+        config = _schedule_config_cache.get('config')
+    if config:
+        return config
+
+    hours, closures, durations = {}, {}, dict(DEFAULT_SERVICE_DURATIONS)
+    try:
+        cursor.execute("SELECT weekday, start_time, end_time, staff_count FROM clinic_hours")
+        rows = [(r['weekday'], to_minutes(r['start_time']), to_minutes(r['end_time']), r['staff_count']) for r in cursor.fetchall()]
+        cursor.execute("SELECT closure_date, reason FROM clinic_closures WHERE closure_date >= %s", (get_local_now().date(),))
+        closures = {r['closure_date']: r['reason'] for r in cursor.fetchall()}
+        cursor.execute("SELECT service_type, duration_minutes FROM service_durations")
+        durations.update({r['service_type']: r['duration_minutes'] for r in cursor.fetchall()})
+    except Error as e:
+        print(f"schedule tables unavailable, using defaults: {e}")
+        rows = []
+
+    for weekday, start, end, staff in (rows or DEFAULT_CLINIC_HOURS):
+        hours.setdefault(weekday, []).append((start, end, staff))
+
+    config = {'hours': hours, 'closures': closures, 'durations': durations}
+    with _schedule_lock:
+        _schedule_config_cache['config'] = config
+    return config
+
+def get_service_minutes(config, service_type):
+    return config['durations'].get(service_type, DEFAULT_SERVICE_MINUTES)
+
+def get_capacity_vector(config, req_date):
+    # Per-minute staff count for one day; 0 means closed.
+    with _schedule_lock:
+        capacity = _capacity_cache.get(req_date)
+    if capacity is not None:
+        return capacity
+
+    capacity = [0] * MINUTES_PER_DAY
+    if req_date not in config['closures']:
+        for start, end, staff in config['hours'].get(req_date.weekday(), []):
+            for minute in range(start, end):
+                capacity[minute] += staff
+
+    with _schedule_lock:
+        _capacity_cache[req_date] = capacity
+    return capacity
+
+def get_load_vector(cursor, config, date_str, exclude_id=None):
+    # Per-minute count of active appointments plus live waitlist holds, built from a diff array.
+    cursor.execute("""
+        SELECT id, appointment_time, service_type FROM appointments 
+        WHERE appointment_date = %s 
+        AND status IN ('pending', 'approved')
+    """, (date_str,))
+    rows = cursor.fetchall()
+    cursor.execute("""
+        SELECT NULL AS id, offered_time AS appointment_time, service_type FROM waitlist 
+        WHERE window_date = %s 
+        AND status = 'offered' AND offer_expires_at > %s
+    """, (date_str, get_local_now()))
+    rows += cursor.fetchall()
+
+    diff = [0] * (MINUTES_PER_DAY + 1)
+    for row in rows:
+        if exclude_id is not None and row['id'] == exclude_id:
+            continue  # the appointment being rescheduled; holds have no id
+        start = to_minutes(row['appointment_time'])
+        end = min(start + get_service_minutes(config, row['service_type']), MINUTES_PER_DAY)
+        diff[start] += 1
+        diff[end] -= 1
+
+    load, running = [0] * MINUTES_PER_DAY, 0
+    for minute in range(MINUTES_PER_DAY):
+        running += diff[minute]
+        load[minute] = running
+    return load
+
+def slot_candidates(config, req_date):
+    # Start minutes on the slot grid, skipping times that already passed today
+    now = get_local_now()
+    earliest = to_minutes(now.time()) + 1 if req_date == now.date() else 0
+    return sorted({minute for start, end, _ in config['hours'].get(req_date.weekday(), [])
+                   for minute in range(start, end, SLOT_STEP_MINUTES) if minute >= earliest})
+
+def slot_is_free(capacity, load, start, duration):
+    # Visit must start while staff are on duty, and every minute of it that
+    # falls inside opening hours must stay under that minute's staff count.
+    # Closed minutes (lunch, closing time) are skipped so a visit may run over.
+    if capacity[start] == 0: return False
+    end = start + duration
+    return all(l < c for l, c in zip(load[start:end], capacity[start:end]) if c)
+
+def calculate_available_slots(conn, date_str, service_type=None):
     cursor = conn.cursor(dictionary=True)
     try:
         # Use our FIXED local time
@@ -171,53 +306,18 @@ def calculate_available_slots(conn, date_str):
         except ValueError:
             return [] 
 
-        is_today = (req_date == now.date())
-        current_time = now.time()
+        if req_date < now.date():
+            return []
 
-        possible_hours = [8, 9, 10, 11, 13, 14, 15, 16] 
-        
-        cursor.execute("""
-            SELECT appointment_time FROM appointments 
-            WHERE appointment_date = %s 
-            AND status IN ('pending', 'approved')
-        """, (date_str,))
-        
-        taken_start_times = []
-        for row in cursor.fetchall():
-            seconds = int(row['appointment_time'].total_seconds())
-            h = seconds // 3600
-            m = (seconds % 3600) // 60
-            taken_dt = datetime.combine(req_date, dt_time(h, m, 0))
-            taken_start_times.append(taken_dt)
-
-        available = []
-
-        for h in possible_hours:
-            for m in [0, 30]:
-                slot_time = dt_time(h, m, 0)
-                slot_dt = datetime.combine(req_date, slot_time)
-                
-                is_blocked = False
-                for taken_dt in taken_start_times:
-                    taken_end = taken_dt + timedelta(hours=1)
-                    if taken_dt <= slot_dt < taken_end:
-                        is_blocked = True
-                        break
-                
-                if is_blocked:
-                    continue 
+        config = load_schedule_config(cursor)
+        capacity = get_capacity_vector(config, req_date)
+        if not any(capacity):
+            return []
 
-                if is_today:
-                    if slot_time <= current_time:
-                        continue 
-                
-                ampm = "AM" if h < 12 else "PM"
-                display_h = h if h <= 12 else h - 12
-                display_h = 12 if display_h == 0 else display_h
-                nice_time = f"{display_h:02d}:{m:02d} {ampm}"
-                available.append(nice_time)
+        duration = get_service_minutes(config, service_type)
+        load = get_load_vector(cursor, config, date_str)
 
-        return available
+        return [format_minutes(minute) for minute in slot_candidates(config, req_date) if slot_is_free(capacity, load, minute, duration)]
     finally:
         cursor.close()
 
@@ -264,51 +364,41 @@ def create_default_users():
         cursor.close()
         conn.close()
 
-def validate_booking_rules(cursor, date_str, time_str):
+def validate_booking_rules(cursor, date_str, time_str, service_type=None, exclude_id=None):
     try:
         booking_date = datetime.strptime(date_str, "%Y-%m-%d").date()
         # [FIX] Use local time for past date check
-        now_date = get_local_now().date()
+        now = get_local_now()
         
-        if booking_date < now_date:
+        if booking_date < now.date():
             return "You cannot book appointments in the past."
-        if booking_date.weekday() == 6: 
-            return "The clinic is closed on Sundays."
     except ValueError:
         return "Invalid date format. Please use YYYY-MM-DD."
 
     try:
-        clean_time = time_str.upper().replace(" AM", "").replace(" PM", "").strip()
-        if "AM" in time_str.upper() or "PM" in time_str.upper():
-             t = datetime.strptime(time_str, "%I:%M %p").time()
-        else:
-             if len(time_str) == 5: time_str += ":00"
-             t = datetime.strptime(time_str, "%H:%M:%S").time()
-        booking_time = t
+        booking_time = parse_booking_time(time_str)
     except ValueError:
         return "Invalid time format."
 
-    if booking_time.hour == 12:
-        return "Clinic is closed for lunch from 12:00 PM to 1:00 PM."
-    if booking_time.hour >= 19:
-        return "Clinic is closed. Operations end at 7:00 PM."
-    if booking_time.hour < 8:
-        return "Clinic opens at 8:00 AM."
+    if booking_date == now.date() and booking_time <= now.time():
+        return "That time has already passed. Please pick a later slot."
 
-    sql_time_str = booking_time.strftime("%H:%M:%S")
+    config = load_schedule_config(cursor)
+    capacity = get_capacity_vector(config, booking_date)
 
-    cursor.execute("""
-        SELECT id, appointment_time FROM appointments 
-        WHERE appointment_date = %s 
-        AND status IN ('pending', 'approved')
-        AND (
-            TIME_TO_SEC(TIMEDIFF(appointment_time, %s)) > -3600 
-            AND 
-            TIME_TO_SEC(TIMEDIFF(appointment_time, %s)) < 3600
-        )
-    """, (date_str, sql_time_str, sql_time_str))
-    
-    if cursor.fetchone():
+    if booking_date in config['closures']:
+        return f"The clinic is closed on {booking_date.strftime('%B %d, %Y')} ({config['closures'][booking_date]})."
+    if not any(capacity):
+        return f"The clinic is closed on {booking_date.strftime('%A')}s."
+
+    start = to_minutes(booking_time)
+    if capacity[start] == 0:
+        shifts = sorted(config['hours'][booking_date.weekday()])
+        hours_text = ", ".join(f"{format_minutes(s)} - {format_minutes(e)}" for s, e, _ in shifts)
+        return f"Clinic is closed at that time. Opening hours: {hours_text}."
+
+    load = get_load_vector(cursor, config, date_str, exclude_id)
+    if not slot_is_free(capacity, load, start, get_service_minutes(config, service_type)):
         return f"Time slot conflict! Please select a different time."
 
     return None 
@@ -363,12 +453,500 @@ def send_email_notification(to_email: str, student_name: str, status: str, date:
     except Exception as e:
         print(f"Email error: {e}")
 
+# --- archival (hot/cold split) ---
+# Closed appointments older than the horizon are moved into appointments_archive
+# (and their chat rows into chat_history_archive) in small chunks, so the hot
+# tables only carry what the dashboards actually poll.
+
+ARCHIVE_HORIZON_DAYS = int(os.getenv("ARCHIVE_HORIZON_DAYS", "180"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))
+ARCHIVE_INTERVAL_HOURS = int(os.getenv("ARCHIVE_INTERVAL_HOURS", "24"))
+
+APPOINTMENT_COLUMNS = ["id", "student_id", "service_type", "urgency", "appointment_date", "appointment_time", "reason", "booking_mode", "status", "admin_note", "created_at", "updated_at"]
+CHAT_COLUMNS = ["id", "student_id", "message", "sender", "appointment_id", "created_at"]
+
+def get_archive_cutoff(horizon_days=None):
+    horizon_days = ARCHIVE_HORIZON_DAYS if horizon_days is None else horizon_days
+    return get_local_now().date() - timedelta(days=horizon_days)
+
+def _archive_chunk(cursor, ids, chat_only=False):
+    # Plain INSERTs on purpose: an id that already exists in the archive must
+    # fail the chunk (and roll it back) rather than be skipped and then deleted.
+    marks = ", ".join(["%s"] * len(ids))
+    appt_cols, chat_cols = ", ".join(APPOINTMENT_COLUMNS), ", ".join(CHAT_COLUMNS)
+
+    if chat_only:
+        cursor.execute(f"INSERT INTO chat_history_archive ({chat_cols}) SELECT {chat_cols} FROM chat_history WHERE id IN ({marks})", ids)
+        cursor.execute(f"DELETE FROM chat_history WHERE id IN ({marks})", ids)
+        return 0, cursor.rowcount
+
+    cursor.execute(f"INSERT INTO appointments_archive ({appt_cols}) SELECT {appt_cols} FROM appointments WHERE id IN ({marks})", ids)
+    # chat rows go first, otherwise ON DELETE SET NULL would detach them from the appointment
+    cursor.execute(f"INSERT INTO chat_history_archive ({chat_cols}) SELECT {chat_cols} FROM chat_history WHERE appointment_id IN ({marks})", ids)
+    cursor.execute(f"DELETE FROM chat_history WHERE appointment_id IN ({marks})", ids)
+    moved_chat = cursor.rowcount
+    cursor.execute(f"DELETE FROM appointments WHERE id IN ({marks})", ids)
+    return cursor.rowcount, moved_chat
+
+def archive_old_records(horizon_days=None, batch_size=None):
+    # Each chunk is its own short transaction, so the job can be stopped
+    # and re-run at any time without holding long locks.
+    cutoff = get_archive_cutoff(horizon_days)
+    batch_size = batch_size or ARCHIVE_BATCH_SIZE
+    moved = {"appointments": 0, "chat_history": 0}
+
+    conn = get_db()
+    cursor = conn.cursor(buffered=True)
+    try:
+        while True:
+            cursor.execute("""
+                SELECT id FROM appointments 
+                WHERE appointment_date < %s 
+                AND status IN ('completed', 'canceled', 'rejected', 'noshow')
+                ORDER BY appointment_date, id LIMIT %s FOR UPDATE
+            """, (cutoff, batch_size))
+            ids = [row[0] for row in cursor.fetchall()]
+            if not ids: break
+            appts, chats = _archive_chunk(cursor, ids)
+            conn.commit()
+            moved["appointments"] += appts
+            moved["chat_history"] += chats
+
+        # loose chat messages that never got tied to an appointment
+        while True:
+            cursor.execute("""
+                SELECT id FROM chat_history 
+                WHERE appointment_id IS NULL AND created_at < %s 
+                ORDER BY created_at, id LIMIT %s FOR UPDATE
+            """, (cutoff, batch_size))
+            ids = [row[0] for row in cursor.fetchall()]
+            if not ids: break
+            _, chats = _archive_chunk(cursor, ids, chat_only=True)
+            conn.commit()
+            moved["chat_history"] += chats
+    except Error:
+        # chunks committed so far stay archived; the caller sees the failure
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+    return moved
+
+def archive_worker():
+    while True:
+        try:
+            moved = archive_old_records()
+            if any(moved.values()): print(f"Archived: {moved}")
+        except Exception as e:
+            print(f"Archive error: {e}")
+        time.sleep(ARCHIVE_INTERVAL_HOURS * 3600)
+
+# --- triage queue ---
+# The nurse queue (approved appointments, Urgent first, then date/time) is kept
+# in memory and updated on appointment writes, so dashboard polls don't have to
+# download and sort every appointment. Admins claim an item before acting on it.
+# Claims live in queue_leases so they hold across workers, and the version sent
+# to clients is a hash of the snapshot itself, so equal versions mean equal queues
+# whichever worker answered. The lease table is read at most once per
+# QUEUE_LEASE_CACHE_SECONDS per worker, however many dashboards are polling.
+
+QUEUE_STATUSES = ('approved',)
+QUEUE_LEASE_SECONDS = 120
+QUEUE_REBUILD_SECONDS = 30  # full reload also picks up writes from other workers
+QUEUE_LEASE_CACHE_SECONDS = 2
+
+_queue_lease_lock = threading.Lock()
+_queue_lease_cache = TTLCache(maxsize=1, ttl=QUEUE_LEASE_CACHE_SECONDS)
+
+class TriageQueue:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}   # appointment id -> queue item
+        self.order = []     # sorted priority keys, last element is the id
+        self.loaded_at = 0
+
+    @staticmethod
+    def priority(item):
+        return (0 if item['urgency'] == 'Urgent' else 1, item['appointment_date'], to_minutes(item['raw_time']), item['id'])
+
+    def _remove(self, appointment_id):
+        item = self.entries.pop(appointment_id, None)
+        if item:
+            self.order.pop(bisect.bisect_left(self.order, self.priority(item)))
+
+    def upsert(self, item):
+        with self.lock:
+            if self.entries.get(item['id']) == item: return
+            self._remove(item['id'])
+            self.entries[item['id']] = item
+            bisect.insort(self.order, self.priority(item))
+
+    def remove(self, appointment_id):
+        with self.lock:
+            self._remove(appointment_id)
+
+    def replace_all(self, items):
+        with self.lock:
+            self.entries = {item['id']: item for item in items}
+            self.order = sorted(self.priority(item) for item in items)
+            self.loaded_at = time.time()
+
+    def snapshot(self, limit):
+        with self.lock:
+            items = [{k: v for k, v in self.entries[key[-1]].items() if k != 'raw_time'} for key in self.order[:limit]]
+            return len(self.order), items
+
+triage_queue = TriageQueue()
+
+def get_queue_leases(cursor):
+    # appointment id -> name of the admin holding a live claim
+    cursor.execute("SELECT appointment_id, full_name FROM queue_leases WHERE expires_at > %s", (get_local_now(),))
+    return {row['appointment_id']: row['full_name'] for row in cursor.fetchall()}
+
+def cached_queue_leases():
+    with _queue_lease_lock:
+        leases = _queue_lease_cache.get('leases')
+    if leases is not None:
+        return leases
+
+    def load():
+        conn = get_db()
+        cursor = conn.cursor(dictionary=True)
+        try: return get_queue_leases(cursor)
+        finally: cursor.close(); conn.close()
+
+    # polls arriving while the cache is cold share a single query
+    leases = read_flights.do(("queue_leases",), load)
+    with _queue_lease_lock:
+        _queue_lease_cache['leases'] = leases
+    return leases
+
+def forget_queue_leases():
+    # claims made through this worker show up on its next poll
+    with _queue_lease_lock:
+        _queue_lease_cache.clear()
+
+def queue_lease_holder(cursor, appointment_id, user_id):
+    # Name of another admin holding a live claim, else None
+    cursor.execute("SELECT full_name FROM queue_leases WHERE appointment_id = %s AND user_id != %s AND expires_at > %s", (appointment_id, user_id, get_local_now()))
+    row = cursor.fetchone()
+    return row['full_name'] if row else None
+
+def claim_queue_lease(conn, appointment_id, user_id, full_name):
+    # Takes or renews the claim; returns the other holder's name if it is taken.
+    now = get_local_now()
+    expires_at = now + timedelta(seconds=QUEUE_LEASE_SECONDS)
+    cursor = conn.cursor(dictionary=True, buffered=True)
+    try:
+        try:
+            cursor.execute("INSERT INTO queue_leases (appointment_id, user_id, full_name, expires_at) VALUES (%s, %s, %s, %s)", (appointment_id, user_id, full_name, expires_at))
+            conn.commit()
+            return None
+        except mysql.connector.IntegrityError:
+            conn.rollback()  # already has a lease row, check it under a lock
+
+        cursor.execute("SELECT user_id, full_name, expires_at FROM queue_leases WHERE appointment_id = %s FOR UPDATE", (appointment_id,))
+        lease = cursor.fetchone()
+        if lease and lease['user_id'] != user_id and lease['expires_at'] > now:
+            conn.rollback()
+            return lease['full_name']
+        cursor.execute("UPDATE queue_leases SET user_id = %s, full_name = %s, expires_at = %s WHERE appointment_id = %s", (user_id, full_name, expires_at, appointment_id))
+        conn.commit()
+        return None
+    finally: cursor.close()
+
+QUEUE_SELECT = """
+    SELECT a.id, a.student_id, a.service_type, a.urgency, a.appointment_date, a.appointment_time, a.reason, a.status, u.full_name as student_name 
+    FROM appointments a JOIN users u ON a.student_id = u.id 
+"""
+
+def queue_item(row):
+    return {
+        'id': row['id'], 'student_id': row['student_id'], 'student_name': row['student_name'],
+        'service_type': row['service_type'], 'urgency': row['urgency'], 'reason': row['reason'], 'status': row['status'],
+        'appointment_date': str(row['appointment_date']), 'appointment_time': str(row['appointment_time']),
+        'raw_time': row['appointment_time'],
+    }
+
+def refresh_queue_if_stale():
+    if time.time() - triage_queue.loaded_at < QUEUE_REBUILD_SECONDS: return
+    conn = get_db()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        marks = ", ".join(["%s"] * len(QUEUE_STATUSES))
+        cursor.execute(QUEUE_SELECT + f"WHERE a.status IN ({marks})", QUEUE_STATUSES)
+        triage_queue.replace_all([queue_item(row) for row in cursor.fetchall()])
+    finally: cursor.close(); conn.close()
+
+def sync_queue_entry(conn, appointment_id):
+    # Call after committing a write that may move an appointment in or out of the queue
+    if not triage_queue.loaded_at: return  # first poll will load everything
+    cursor = conn.cursor(dictionary=True, buffered=True)
+    try:
+        cursor.execute(QUEUE_SELECT + "WHERE a.id = %s", (appointment_id,))
+        row = cursor.fetchone()
+    finally: cursor.close()
+    if row and row['status'] in QUEUE_STATUSES:
+        triage_queue.upsert(queue_item(row))
+    else:
+        triage_queue.remove(appointment_id)
+
+# --- rate limiting & request coalescing ---
+# Token buckets keyed by JWT user_id (or client IP when there is no valid token),
+# with separate budgets for the LLM chat and the cheap polled reads.
+# RATE_LIMIT_BACKEND=mysql shares buckets between workers via rate_limit_buckets.
+
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMITS = {
+    # budget: (tokens per second, burst)
+    "chat": (0.2, 5),
+    "read": (5.0, 20),
+}
+
+def refill_bucket(tokens, last, now, rate, burst):
+    tokens = min(burst, tokens + (now - last) * rate)
+    if tokens >= 1:
+        return True, tokens - 1, 0
+    return False, tokens, (1 - tokens) / rate
+
+class MemoryRateLimitBackend:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = TTLCache(maxsize=50000, ttl=3600)  # idle buckets simply expire
+
+    def take(self, key, rate, burst):
+        now = time.time()
+        with self.lock:
+            tokens, last = self.buckets.get(key, (burst, now))
+            allowed, tokens, retry_after = refill_bucket(tokens, last, now, rate, burst)
+            self.buckets[key] = (tokens, now)
+        return allowed, retry_after
+
+class MySQLRateLimitBackend:
+    def take(self, key, rate, burst):
+        now = time.time()
+        conn = get_db()
+        cursor = conn.cursor(buffered=True)
+        try:
+            cursor.execute("INSERT IGNORE INTO rate_limit_buckets (bucket_key, tokens, updated_at) VALUES (%s, %s, %s)", (key, burst, now))
+            cursor.execute("SELECT tokens, updated_at FROM rate_limit_buckets WHERE bucket_key = %s FOR UPDATE", (key,))
+            tokens, last = cursor.fetchone()
+            allowed, tokens, retry_after = refill_bucket(tokens, last, now, rate, burst)
+            cursor.execute("UPDATE rate_limit_buckets SET tokens = %s, updated_at = %s WHERE bucket_key = %s", (tokens, now, key))
+            conn.commit()
+            return allowed, retry_after
+        finally: cursor.close(); conn.close()
+
+rate_limiter = MySQLRateLimitBackend() if RATE_LIMIT_BACKEND == "mysql" else MemoryRateLimitBackend()
+optional_security = HTTPBearer(auto_error=False)
+
+def rate_limit(budget: str):
+    rate, burst = RATE_LIMITS[budget]
+
+    def dependency(request: Request, credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)):
+        client = None
+        if credentials:
+            try: client = f"user:{jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])['user_id']}"
+            except Exception: pass
+        client = client or f"ip:{request.client.host if request.client else 'unknown'}"
+
+        allowed, retry_after = rate_limiter.take(f"{budget}:{client}", rate, burst)
+        if not allowed:
+            raise HTTPException(status_code=429, detail="Too many requests. Please slow down.", headers={"Retry-After": str(int(retry_after) + 1)})
+    return dependency
+
+class SingleFlight:
+    # Concurrent calls with the same key share one computation.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, fn):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = {'done': threading.Event(), 'result': None, 'error': None}
+
+        if not leader:
+            call['done'].wait()
+            if call['error']: raise call['error']
+            return call['result']
+
+        try:
+            call['result'] = fn()
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self.lock: del self.calls[key]
+            call['done'].set()
+        return call['result']
+
+read_flights = SingleFlight()
+
+# --- waitlist & slot backfill ---
+# Students join a waitlist for a day (optionally a time window). Whenever a slot
+# frees up, offer_freed_slots() walks that day's waiting entries in FIFO order and
+# puts the first fitting slot on hold for the student. Holds count as load in the
+# schedule engine until they are accepted, declined or expire.
+
+WAITLIST_HOLD_MINUTES = 15
+WAITLIST_SWEEP_SECONDS = 60
+ACTIVE_STATUSES = ('pending', 'approved')
+
+def offer_freed_slots(conn, date_str, skip_ids=()):
+    date_str = str(date_str)
+    cursor = conn.cursor(dictionary=True, buffered=True)
+    offered = 0
+    try:
+        req_date = datetime.strptime(date_str, "%Y-%m-%d").date()
+        if req_date < get_local_now().date(): return 0
+
+        # uses idx_waitlist_date_status, so a freed slot only looks at its own day
+        cursor.execute("""
+            SELECT id, student_id, service_type, urgency, start_time, end_time FROM waitlist 
+            WHERE window_date = %s AND status = 'waiting' 
+            ORDER BY queued_at, id
+        """, (date_str,))
+        entries = [e for e in cursor.fetchall() if e['id'] not in skip_ids]
+        if not entries: return 0
+
+        # same rule accept_waitlist_offer enforces: one pending request per urgency,
+        # so a hold is never parked on a student who couldn't take it
+        marks = ", ".join(["%s"] * len(entries))
+        cursor.execute(f"SELECT DISTINCT student_id, urgency FROM appointments WHERE status = 'pending' AND student_id IN ({marks})", [e['student_id'] for e in entries])
+        blocked = {(row['student_id'], row['urgency']) for row in cursor.fetchall()}
+        entries = [e for e in entries if (e['student_id'], e['urgency']) not in blocked]
+        if not entries: return 0
+
+        config = load_schedule_config(cursor)
+        capacity = get_capacity_vector(config, req_date)
+        load = get_load_vector(cursor, config, date_str)
+        candidates = slot_candidates(config, req_date)
+        expires_at = get_local_now() + timedelta(minutes=WAITLIST_HOLD_MINUTES)
+
+        for entry in entries:
+            duration = get_service_minutes(config, entry['service_type'])
+            low = to_minutes(entry['start_time']) if entry['start_time'] is not None else 0
+            high = to_minutes(entry['end_time']) if entry['end_time'] is not None else MINUTES_PER_DAY
+            minute = next((m for m in candidates if low <= m < high and slot_is_free(capacity, load, m, duration)), None)
+            if minute is None: continue
+
+            cursor.execute("UPDATE waitlist SET status = 'offered', offered_time = %s, offer_expires_at = %s WHERE id = %s AND status = 'waiting'", (f"{minute // 60:02d}:{minute % 60:02d}:00", expires_at, entry['id']))
+            if cursor.rowcount == 0: continue
+            cursor.execute("INSERT INTO notifications (student_id, message) VALUES (%s, %s)", (entry['student_id'], f"A slot opened on {req_date.strftime('%B %d, %Y')} at {format_minutes(minute)}. It is held for you for {WAITLIST_HOLD_MINUTES} minutes."))
+            conn.commit()
+
+            for m in range(minute, min(minute + duration, MINUTES_PER_DAY)): load[m] += 1
+            offered += 1
+    except Error as e:
+        conn.rollback()
+        print(f"Waitlist error: {e}")
+    finally: cursor.close()
+    return offered
+
+def expire_waitlist_offers():
+    now = get_local_now()
+    conn = get_db()
+    cursor = conn.cursor(buffered=True)
+    try:
+        cursor.execute("SELECT DISTINCT window_date FROM waitlist WHERE status = 'offered' AND offer_expires_at <= %s", (now,))
+        dates = [row[0] for row in cursor.fetchall()]
+        cursor.execute("UPDATE waitlist SET status = 'expired' WHERE status = 'offered' AND offer_expires_at <= %s", (now,))
+        cursor.execute("UPDATE waitlist SET status = 'expired' WHERE status = 'waiting' AND window_date < %s", (now.date(),))
+        conn.commit()
+        # slots from lapsed holds go to the next student in line
+        for d in dates: offer_freed_slots(conn, d)
+    finally: cursor.close(); conn.close()
+
+def waitlist_worker():
+    while True:
+        try: expire_waitlist_offers()
+        except Exception as e: print(f"Waitlist error: {e}")
+        time.sleep(WAITLIST_SWEEP_SECONDS)
+
+# --- day-end processing ---
+# Past-dated appointments that are still approved become no-shows, and pending
+# requests nobody reviewed are canceled. Rows are picked with one indexed query
+# per batch and each batch commits on its own, so the job is idempotent and can
+# resume after a crash (already-processed rows no longer match).
+
+DAY_END_BATCH_SIZE = int(os.getenv("DAY_END_BATCH_SIZE", "500"))
+DAY_END_INTERVAL_HOURS = int(os.getenv("DAY_END_INTERVAL_HOURS", "1"))  # cheap when there is nothing to do
+
+DAY_END_NOTES = {
+    'approved': ('noshow', "Automatically marked as no show at day end."),
+    'pending': ('canceled', "Request expired: it was not reviewed before the appointment date."),
+}
+
+def process_day_end(batch_size=None):
+    started = time.perf_counter()
+    batch_size = batch_size or DAY_END_BATCH_SIZE
+    today = get_local_now().date()
+    report = {"processed": 0, "noshow": 0, "canceled": 0, "batches": 0}
+
+    conn = get_db()
+    cursor = conn.cursor(buffered=True)
+    try:
+        while True:
+            cursor.execute("""
+                SELECT id, student_id, status, appointment_date FROM appointments 
+                WHERE status IN ('pending', 'approved') AND appointment_date < %s 
+                ORDER BY status, appointment_date, id LIMIT %s FOR UPDATE
+            """, (today, batch_size))
+            rows = cursor.fetchall()
+            if not rows: break
+
+            marks = ", ".join(["%s"] * len(rows))
+            cursor.execute(f"""
+                UPDATE appointments SET 
+                    admin_note = COALESCE(admin_note, CASE status WHEN 'approved' THEN %s ELSE %s END), 
+                    status = CASE status WHEN 'approved' THEN 'noshow' ELSE 'canceled' END, 
+                    updated_at = NOW() 
+                WHERE id IN ({marks}) AND status IN ('pending', 'approved')
+            """, (DAY_END_NOTES['approved'][1], DAY_END_NOTES['pending'][1], *[row[0] for row in rows]))
+
+            notifications = []
+            for appt_id, student_id, status, appt_date in rows:
+                new_status, note = DAY_END_NOTES[status]
+                notifications.append((student_id, f"Appointment #{appt_id} on {appt_date.strftime('%B %d, %Y')}: {note}"))
+                report[new_status] += 1
+            cursor.executemany("INSERT INTO notifications (student_id, message) VALUES (%s, %s)", notifications)
+            conn.commit()
+
+            for row in rows: triage_queue.remove(row[0])
+            report["processed"] += len(rows)
+            report["batches"] += 1
+    except Error as e:
+        conn.rollback()
+        print(f"Day-end error: {e}")
+    finally:
+        cursor.close()
+        conn.close()
+
+    report["seconds"] = round(time.perf_counter() - started, 3)
+    return report
+
+def day_end_worker():
+    while True:
+        try:
+            report = process_day_end()
+            if report["processed"]: print(f"Day-end: {report}")
+        except Exception as e:
+            print(f"Day-end error: {e}")
+        time.sleep(DAY_END_INTERVAL_HOURS * 3600)
+
 # --- main app setup ---
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 
 @app.on_event("startup")
 def on_startup():
     create_default_users()
+    threading.Thread(target=archive_worker, daemon=True).start()
+    threading.Thread(target=waitlist_worker, daemon=True).start()
+    threading.Thread(target=day_end_worker, daemon=True).start()
 
 app.add_middleware(
     CORSMiddleware,
@@ -413,6 +991,54 @@ class AppointmentReschedule(BaseModel):
     appointment_date: str
     appointment_time: str     
 
+class WaitlistJoin(BaseModel):
+    date: str
+    service_type: str
+    urgency: str = "Normal"
+    reason: str
+    start_time: Optional[str] = None
+    end_time: Optional[str] = None
+
+# --- list response rows ---
+# List endpoints fetch plain tuples with dates already formatted by MySQL and wrap
+# them in slotted dataclasses; orjson serializes those natively, so large admin
+# lists skip the per-value jsonable_encoder walk.
+
+@dataclass(slots=True)
+class AppointmentRow:
+    id: int
+    student_id: int
+    service_type: str
+    urgency: str
+    appointment_date: str
+    appointment_time: str
+    reason: str
+    booking_mode: str
+    status: str
+    admin_note: Optional[str]
+    created_at: Optional[str]
+    updated_at: Optional[str]
+    student_name: str
+    student_email: Optional[str] = None  # admin lists only
+
+@dataclass(slots=True)
+class UserRow:
+    id: int
+    full_name: str
+    email: str
+    role: str
+    created_at: str
+
+# Same order as AppointmentRow; note: no '%s' in the formats, mysql-connector treats it as a placeholder
+APPOINTMENT_ROW_SELECT = """
+    a.id, a.student_id, a.service_type, a.urgency, 
+    DATE_FORMAT(a.appointment_date, '%Y-%m-%d') AS appointment_date, 
+    TIME_FORMAT(a.appointment_time, '%H:%i:%S') AS appointment_time, 
+    a.reason, a.booking_mode, a.status, a.admin_note, 
+    DATE_FORMAT(a.created_at, '%Y-%m-%dT%H:%i:%S') AS created_at, 
+    DATE_FORMAT(a.updated_at, '%Y-%m-%dT%H:%i:%S') AS updated_at, 
+    u.full_name AS student_name"""
+
 @app.post("/api/register")
 def register(user: UserRegister):
     conn = get_db()
@@ -451,29 +1077,55 @@ def login(user: UserLogin):
         return {"token": create_token(db_user['id'], db_user['role'], db_user['full_name']), "role": db_user['role'], "user_id": db_user['id'], "full_name": db_user['full_name']}
     finally: cursor.close(); conn.close()
 
-@app.get("/api/appointments")
-def get_appointments(current_user = Depends(get_current_user)):
-    conn = get_db()
-    cursor = conn.cursor(dictionary=True)
+@app.get("/api/appointments", response_model=List[AppointmentRow], dependencies=[Depends(rate_limit("read"))])
+def get_appointments(from_date: Optional[str] = None, to_date: Optional[str] = None, current_user = Depends(get_current_user)):
     try:
-        if current_user['role'] == 'student':
-            cursor.execute("SELECT a.*, u.full_name as student_name FROM appointments a JOIN users u ON a.student_id = u.id WHERE a.student_id = %s ORDER BY a.appointment_date DESC", (current_user['user_id'],))
-        else:
-            cursor.execute("SELECT a.*, u.full_name as student_name, u.email as student_email FROM appointments a JOIN users u ON a.student_id = u.id ORDER BY a.appointment_date DESC")
-        
-        results = cursor.fetchall()
-        for row in results:
-            row['appointment_date'] = str(row['appointment_date'])
-            row['appointment_time'] = str(row['appointment_time'])
-        return results
-    finally: cursor.close(); conn.close()
+        from_day = datetime.strptime(from_date, "%Y-%m-%d").date() if from_date else None
+        to_day = datetime.strptime(to_date, "%Y-%m-%d").date() if to_date else None
+    except ValueError: raise HTTPException(status_code=400, detail="Invalid date format. Please use YYYY-MM-DD.")
+
+    filters, params = [], []
+    if current_user['role'] == 'student':
+        filters.append("a.student_id = %s"); params.append(current_user['user_id'])
+    if from_date:
+        filters.append("a.appointment_date >= %s"); params.append(from_day)
+    if to_date:
+        filters.append("a.appointment_date <= %s"); params.append(to_day)
+
+    columns = APPOINTMENT_ROW_SELECT
+    if current_user['role'] != 'student':
+        columns += ", u.email AS student_email"
+    where = (" WHERE " + " AND ".join(filters)) if filters else ""
+
+    # The archive is only read when the requested range reaches past the horizon
+    include_archive = (from_day or to_day) and (not from_day or from_day < get_archive_cutoff())
+
+    query = f"SELECT {columns} FROM appointments a JOIN users u ON a.student_id = u.id{where}"
+    if include_archive:
+        query += f" UNION ALL SELECT {columns} FROM appointments_archive a JOIN users u ON a.student_id = u.id{where}"
+        params = params * 2
+    query += " ORDER BY appointment_date DESC"
+
+    def load():
+        conn = get_db()
+        cursor = conn.cursor()
+        try:
+            cursor.execute(query, tuple(params))
+            return [AppointmentRow(*row) for row in cursor.fetchall()]
+        finally: cursor.close(); conn.close()
 
-@app.get("/api/slots")
-def get_available_slots_endpoint(date: str):
-    conn = get_db()
-    try:
-        return calculate_available_slots(conn, date)
-    finally: conn.close()
+    # identical concurrent polls (e.g. several admin tabs) share one query
+    return ORJSONResponse(read_flights.do(("appointments", query, tuple(params)), load))
+
+@app.get("/api/slots", dependencies=[Depends(rate_limit("read"))])
+def get_available_slots_endpoint(date: str, service_type: Optional[str] = None):
+    def load():
+        conn = get_db()
+        try:
+            return calculate_available_slots(conn, date, service_type)
+        finally: conn.close()
+
+    return read_flights.do(("slots", date, service_type), load)
 
 @app.post("/api/appointments")
 def create_appointment(appointment: AppointmentCreate, current_user = Depends(get_current_user)):
@@ -501,7 +1153,7 @@ def create_appointment(appointment: AppointmentCreate, current_user = Depends(ge
                  
              raise HTTPException(status_code=400, detail=detail_msg)
         
-        error_message = validate_booking_rules(cursor, appointment.appointment_date, appointment.appointment_time)
+        error_message = validate_booking_rules(cursor, appointment.appointment_date, appointment.appointment_time, appointment.service_type)
         if error_message: raise HTTPException(status_code=400, detail=error_message)
 
         # Handle time format conversion
@@ -522,6 +1174,9 @@ def update_appointment(appointment_id: int, update: AppointmentUpdate, current_u
     conn = get_db()
     cursor = conn.cursor(dictionary=True, buffered=True)
     try:
+        holder = queue_lease_holder(cursor, appointment_id, current_user['user_id'])
+        if holder: raise HTTPException(status_code=409, detail=f"This appointment is being handled by {holder}.")
+
         cursor.execute("SELECT a.status, a.appointment_date, a.appointment_time, u.email, u.full_name FROM appointments a JOIN users u ON a.student_id = u.id WHERE a.id = %s", (appointment_id,))
         current_appt = cursor.fetchone()
         if not current_appt: raise HTTPException(status_code=404, detail="not found")
@@ -529,7 +1184,12 @@ def update_appointment(appointment_id: int, update: AppointmentUpdate, current_u
         if update.status == 'completed' and current_appt['status'] == 'completed': raise HTTPException(status_code=400, detail="already_scanned")
 
         cursor.execute("UPDATE appointments SET status = %s, admin_note = %s, updated_at = NOW() WHERE id = %s", (update.status, update.admin_note, appointment_id))
+        if update.status not in QUEUE_STATUSES:
+            cursor.execute("DELETE FROM queue_leases WHERE appointment_id = %s", (appointment_id,))
         conn.commit()
+        sync_queue_entry(conn, appointment_id)
+        if current_appt['status'] in ACTIVE_STATUSES and update.status not in ACTIVE_STATUSES:
+            offer_freed_slots(conn, current_appt['appointment_date'])
         
         if update.status in ['approved', 'rejected', 'noshow']:
             d_str = current_appt['appointment_date'].strftime("%B %d, %Y")
@@ -554,11 +1214,11 @@ def reschedule_appointment(appointment_id: int, r: AppointmentReschedule, curren
     conn = get_db()
     cursor = conn.cursor(dictionary=True, buffered=True)
     try:
-        cursor.execute("SELECT student_id FROM appointments WHERE id = %s", (appointment_id,))
+        cursor.execute("SELECT student_id, service_type, status, appointment_date FROM appointments WHERE id = %s", (appointment_id,))
         appt = cursor.fetchone()
         if not appt or appt['student_id'] != current_user['user_id']: raise HTTPException(status_code=403, detail="unauthorized")
 
-        error_msg = validate_booking_rules(cursor, r.appointment_date, r.appointment_time)
+        error_msg = validate_booking_rules(cursor, r.appointment_date, r.appointment_time, appt['service_type'], appointment_id)
         if error_msg: raise HTTPException(status_code=400, detail=error_msg)
 
         # Handle time format conversion for reschedule
@@ -569,6 +1229,8 @@ def reschedule_appointment(appointment_id: int, r: AppointmentReschedule, curren
 
         cursor.execute("UPDATE appointments SET appointment_date = %s, appointment_time = %s, status = 'pending', updated_at = NOW() WHERE id = %s", (r.appointment_date, t_str, appointment_id))
         conn.commit()
+        triage_queue.remove(appointment_id)
+        if appt['status'] in ACTIVE_STATUSES: offer_freed_slots(conn, appt['appointment_date'])
         return {"message": "rescheduled"}
     except Error as e: raise HTTPException(status_code=500, detail=str(e))
     finally: cursor.close(); conn.close()
@@ -578,7 +1240,7 @@ def delete_or_cancel_appointment(appointment_id: int, current_user = Depends(get
     conn = get_db()
     cursor = conn.cursor(dictionary=True, buffered=True)
     try:
-        cursor.execute("SELECT student_id, status FROM appointments WHERE id = %s", (appointment_id,))
+        cursor.execute("SELECT student_id, status, appointment_date FROM appointments WHERE id = %s", (appointment_id,))
         appt = cursor.fetchone()
         if not appt: raise HTTPException(status_code=404, detail="not found")
 
@@ -596,19 +1258,179 @@ def delete_or_cancel_appointment(appointment_id: int, current_user = Depends(get
         else: raise HTTPException(status_code=403, detail="unauthorized")
         
         conn.commit()
+        triage_queue.remove(appointment_id)
+        if appt['status'] in ACTIVE_STATUSES: offer_freed_slots(conn, appt['appointment_date'])
         return {"message": message}
     finally: cursor.close(); conn.close()
 
-@app.get("/api/users")
+@app.post("/api/waitlist")
+def join_waitlist(entry: WaitlistJoin, current_user = Depends(get_current_user)):
+    if current_user['role'] != 'student': raise HTTPException(status_code=403, detail="students only")
+    try:
+        window_date = datetime.strptime(entry.date, "%Y-%m-%d").date()
+        start_time = parse_booking_time(entry.start_time).strftime("%H:%M:%S") if entry.start_time else None
+        end_time = parse_booking_time(entry.end_time).strftime("%H:%M:%S") if entry.end_time else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date or time format.")
+    if window_date < get_local_now().date(): raise HTTPException(status_code=400, detail="You cannot join the waitlist for a past date.")
+
+    conn = get_db()
+    cursor = conn.cursor(dictionary=True, buffered=True)
+    try:
+        # a day the clinic is closed can never free up a slot
+        config = load_schedule_config(cursor)
+        if window_date in config['closures']:
+            raise HTTPException(status_code=400, detail=f"The clinic is closed on {window_date.strftime('%B %d, %Y')} ({config['closures'][window_date]}).")
+        if not any(get_capacity_vector(config, window_date)):
+            raise HTTPException(status_code=400, detail=f"The clinic is closed on {window_date.strftime('%A')}s.")
+
+        cursor.execute("SELECT id FROM waitlist WHERE student_id = %s AND window_date = %s AND status IN ('waiting', 'offered')", (current_user['user_id'], entry.date))
+        if cursor.fetchone(): raise HTTPException(status_code=400, detail="You are already on the waitlist for this day.")
+
+        cursor.execute("INSERT INTO waitlist (student_id, window_date, start_time, end_time, service_type, urgency, reason) VALUES (%s, %s, %s, %s, %s, %s, %s)", (current_user['user_id'], entry.date, start_time, end_time, entry.service_type, entry.urgency, entry.reason))
+        conn.commit()
+        waitlist_id = cursor.lastrowid
+        # a slot may already be open in the requested window
+        offer_freed_slots(conn, entry.date)
+        return {"message": "waitlisted", "id": waitlist_id}
+    except Error as e: raise HTTPException(status_code=500, detail=str(e))
+    finally: cursor.close(); conn.close()
+
+@app.get("/api/waitlist")
+def get_waitlist(current_user = Depends(get_current_user)):
+    if current_user['role'] != 'student': raise HTTPException(status_code=403, detail="students only")
+    conn = get_db()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute("""
+            SELECT id, service_type, urgency, reason, status, 
+                DATE_FORMAT(window_date, '%Y-%m-%d') AS date, 
+                TIME_FORMAT(start_time, '%H:%i:%S') AS start_time, 
+                TIME_FORMAT(end_time, '%H:%i:%S') AS end_time, 
+                TIME_FORMAT(offered_time, '%H:%i:%S') AS offered_time, 
+                DATE_FORMAT(offer_expires_at, '%Y-%m-%dT%H:%i:%S') AS offer_expires_at 
+            FROM waitlist 
+            WHERE student_id = %s AND status IN ('waiting', 'offered') 
+            ORDER BY window_date
+        """, (current_user['user_id'],))
+        return cursor.fetchall()
+    finally: cursor.close(); conn.close()
+
+@app.post("/api/waitlist/{waitlist_id}/accept")
+def accept_waitlist_offer(waitlist_id: int, current_user = Depends(get_current_user)):
+    if current_user['role'] != 'student': raise HTTPException(status_code=403, detail="students only")
+    conn = get_db()
+    cursor = conn.cursor(dictionary=True, buffered=True)
+    try:
+        cursor.execute("SELECT * FROM waitlist WHERE id = %s AND student_id = %s FOR UPDATE", (waitlist_id, current_user['user_id']))
+        entry = cursor.fetchone()
+        if not entry or entry['status'] != 'offered' or entry['offer_expires_at'] <= get_local_now():
+            conn.rollback()
+            raise HTTPException(status_code=400, detail="This offer is no longer available.")
+
+        cursor.execute("SELECT id FROM appointments WHERE student_id = %s AND status = 'pending' AND urgency = %s", (current_user['user_id'], entry['urgency']))
+        if cursor.fetchone():
+            conn.rollback()
+            raise HTTPException(status_code=400, detail="You already have a pending appointment of this urgency. Please wait for it to be handled.")
+
+        # release our own hold first so the engine doesn't count it as a conflict
+        cursor.execute("UPDATE waitlist SET status = 'booked' WHERE id = %s", (waitlist_id,))
+        date_str, time_str = str(entry['window_date']), str(entry['offered_time'])
+        error_message = validate_booking_rules(cursor, date_str, time_str, entry['service_type'])
+        if error_message:
+            conn.rollback()
+            raise HTTPException(status_code=400, detail=error_message)
+
+        cursor.execute("INSERT INTO appointments (student_id, appointment_date, appointment_time, service_type, urgency, reason, booking_mode, status) VALUES (%s, %s, %s, %s, %s, %s, 'standard', 'pending')", (current_user['user_id'], date_str, time_str, entry['service_type'], entry['urgency'], entry['reason']))
+        conn.commit()
+        return {"message": "booked", "id": cursor.lastrowid}
+    except Error as e: raise HTTPException(status_code=500, detail=str(e))
+    finally: cursor.close(); conn.close()
+
+@app.post("/api/waitlist/{waitlist_id}/decline")
+def decline_waitlist_offer(waitlist_id: int, current_user = Depends(get_current_user)):
+    # Turns down this one offered time but stays on the waitlist, at the back of the line
+    conn = get_db()
+    cursor = conn.cursor(dictionary=True, buffered=True)
+    try:
+        cursor.execute("SELECT window_date FROM waitlist WHERE id = %s AND student_id = %s", (waitlist_id, current_user['user_id']))
+        entry = cursor.fetchone()
+        if not entry: raise HTTPException(status_code=404, detail="not found")
+
+        cursor.execute("UPDATE waitlist SET status = 'waiting', offered_time = NULL, offer_expires_at = NULL, queued_at = NOW() WHERE id = %s AND status = 'offered'", (waitlist_id,))
+        conn.commit()
+        if cursor.rowcount > 0: offer_freed_slots(conn, entry['window_date'], skip_ids=(waitlist_id,))
+        return {"message": "declined"}
+    finally: cursor.close(); conn.close()
+
+@app.delete("/api/waitlist/{waitlist_id}")
+def leave_waitlist(waitlist_id: int, current_user = Depends(get_current_user)):
+    conn = get_db()
+    cursor = conn.cursor(dictionary=True, buffered=True)
+    try:
+        cursor.execute("SELECT status, window_date FROM waitlist WHERE id = %s AND student_id = %s", (waitlist_id, current_user['user_id']))
+        entry = cursor.fetchone()
+        if not entry: raise HTTPException(status_code=404, detail="not found")
+
+        cursor.execute("UPDATE waitlist SET status = 'canceled' WHERE id = %s AND status IN ('waiting', 'offered')", (waitlist_id,))
+        conn.commit()
+        # a declined hold goes straight to the next student
+        if entry['status'] == 'offered': offer_freed_slots(conn, entry['window_date'])
+        return {"message": "canceled"}
+    finally: cursor.close(); conn.close()
+
+@app.get("/api/queue", dependencies=[Depends(rate_limit("read"))])
+def get_queue(limit: int = 20, version: Optional[str] = None, current_user = Depends(get_current_user)):
+    if current_user['role'] not in ['admin', 'super_admin']: raise HTTPException(status_code=403, detail="unauthorized")
+    refresh_queue_if_stale()
+    total, items = triage_queue.snapshot(max(1, min(limit, 100)))
+    leases = cached_queue_leases()
+    for item in items: item['claimed_by'] = leases.get(item['id'])
+
+    current_version = hashlib.sha1(repr((total, items)).encode()).hexdigest()[:16]
+    if version == current_version:
+        return {"version": current_version, "unchanged": True}
+    return {"version": current_version, "unchanged": False, "total": total, "items": items}
+
+@app.post("/api/queue/{appointment_id}/claim")
+def claim_queue_item(appointment_id: int, current_user = Depends(get_current_user)):
+    # Also used to renew a claim while the nurse is still filling in the visit
+    if current_user['role'] not in ['admin', 'super_admin']: raise HTTPException(status_code=403, detail="unauthorized")
+    conn = get_db()
+    cursor = conn.cursor(dictionary=True, buffered=True)
+    try:
+        cursor.execute("SELECT status FROM appointments WHERE id = %s", (appointment_id,))
+        appt = cursor.fetchone()
+        if not appt or appt['status'] not in QUEUE_STATUSES:
+            sync_queue_entry(conn, appointment_id)  # this worker's copy was stale
+            raise HTTPException(status_code=404, detail="This appointment is no longer in the queue.")
+
+        holder = claim_queue_lease(conn, appointment_id, current_user['user_id'], current_user['full_name'])
+        if holder: raise HTTPException(status_code=409, detail=f"Already claimed by {holder}.")
+        forget_queue_leases()
+        return {"message": "claimed", "lease_seconds": QUEUE_LEASE_SECONDS}
+    finally: cursor.close(); conn.close()
+
+@app.delete("/api/queue/{appointment_id}/claim")
+def release_queue_item(appointment_id: int, current_user = Depends(get_current_user)):
+    if current_user['role'] not in ['admin', 'super_admin']: raise HTTPException(status_code=403, detail="unauthorized")
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("DELETE FROM queue_leases WHERE appointment_id = %s AND user_id = %s", (appointment_id, current_user['user_id']))
+        conn.commit()
+        forget_queue_leases()
+        return {"message": "released"}
+    finally: cursor.close(); conn.close()
+
+@app.get("/api/users", response_model=List[UserRow])
 def get_users(current_user = Depends(get_current_user)):
     if current_user['role'] != 'super_admin': raise HTTPException(status_code=403, detail="unauthorized")
     conn = get_db()
-    cursor = conn.cursor(dictionary=True)
+    cursor = conn.cursor()
     try:
-        cursor.execute("SELECT id, full_name, email, role, created_at FROM users ORDER BY created_at DESC")
-        results = cursor.fetchall()
-        for row in results: row['created_at'] = str(row['created_at'])
-        return results
+        cursor.execute("SELECT u.id, u.full_name, u.email, u.role, DATE_FORMAT(u.created_at, '%Y-%m-%d %H:%i:%S') FROM users u ORDER BY u.created_at DESC")
+        return ORJSONResponse([UserRow(*row) for row in cursor.fetchall()])
     finally: cursor.close(); conn.close()
 
 @app.delete("/api/users/{user_id}")
@@ -624,11 +1446,23 @@ def delete_user(user_id: int, current_user = Depends(get_current_user)):
     except Error as e: raise HTTPException(status_code=500, detail=str(e))
     finally: cursor.close(); conn.close()
 
+@app.post("/api/admin/day-end")
+def run_day_end(current_user = Depends(get_current_user)):
+    if current_user['role'] not in ['admin', 'super_admin']: raise HTTPException(status_code=403, detail="unauthorized")
+    return {"message": "processed", **process_day_end()}
+
+@app.post("/api/admin/archive")
+def run_archive(horizon_days: Optional[int] = None, current_user = Depends(get_current_user)):
+    if current_user['role'] != 'super_admin': raise HTTPException(status_code=403, detail="unauthorized")
+    try: moved = archive_old_records(horizon_days)
+    except Error as e: raise HTTPException(status_code=500, detail=str(e))
+    return {"message": "archived", **moved}
+
 # ==========================================
 #  SMART AI CHATBOT V2 (OPTIMIZED)
 # ==========================================
 
-@app.post("/api/chat")
+@app.post("/api/chat", dependencies=[Depends(rate_limit("chat"))])
 async def chat_booking(chat: ChatMessage, current_user = Depends(get_current_user)):
     conn = get_db()
     cursor = conn.cursor(dictionary=True, buffered=True)
@@ -739,7 +1573,7 @@ async def chat_booking(chat: ChatMessage, current_user = Depends(get_current_use
                     if "AM" in p_time.upper() or "PM" in p_time.upper():
                         p_time = datetime.strptime(p_time, "%I:%M %p").strftime("%H:%M:%S")
                     
-                    err = validate_booking_rules(cursor, p_date, p_time)
+                    err = validate_booking_rules(cursor, p_date, p_time, data.get('service_type'))
                     if err: return {"response": err, "requires_action": False}
                     
                     cursor.execute("INSERT INTO appointments (student_id, appointment_date, appointment_time, service_type, urgency, reason, booking_mode, status) VALUES (%s, %s, %s, %s, %s, %s, 'ai_chatbot', 'pending')", (current_user['user_id'], p_date, p_time, data['service_type'], requested_urgency, data['reason']))
@@ -753,11 +1587,16 @@ async def chat_booking(chat: ChatMessage, current_user = Depends(get_current_use
                     cursor = conn.cursor(buffered=True)
                     appt_id = clean_id(data.get("appointment_id"))
                     
+                    cursor.execute("SELECT appointment_date, status FROM appointments WHERE id = %s AND student_id = %s", (appt_id, current_user['user_id']))
+                    freed = cursor.fetchone()
+
                     # [FIX] Direct execution to avoid unread result error
                     cursor.execute("UPDATE appointments SET status = 'canceled' WHERE id = %s AND student_id = %s", (appt_id, current_user['user_id']))
                     conn.commit()
                     
                     if cursor.rowcount > 0:
+                        triage_queue.remove(int(appt_id))
+                        if freed[1] in ACTIVE_STATUSES: offer_freed_slots(conn, freed[0])
                         msg = f"Appointment #{appt_id} canceled."
                     else:
                         msg = f"I couldn't find Appointment #{appt_id} or it doesn't belong to you."
@@ -771,11 +1610,16 @@ async def chat_booking(chat: ChatMessage, current_user = Depends(get_current_use
                     cursor = conn.cursor(buffered=True)
                     appt_id = clean_id(data.get("appointment_id"))
                     
+                    cursor.execute("SELECT appointment_date, status FROM appointments WHERE id = %s AND student_id = %s", (appt_id, current_user['user_id']))
+                    freed = cursor.fetchone()
+
                     # [FIX] Direct execution to avoid unread result error
                     cursor.execute("DELETE FROM appointments WHERE id = %s AND student_id = %s", (appt_id, current_user['user_id']))
                     conn.commit()
                     
                     if cursor.rowcount > 0:
+                        triage_queue.remove(int(appt_id))
+                        if freed[1] in ACTIVE_STATUSES: offer_freed_slots(conn, freed[0])
                         msg = f"Appointment #{appt_id} deleted permanently."
                     else:
                         msg = f"I couldn't find Appointment #{appt_id} or it doesn't belong to you."
@@ -794,19 +1638,22 @@ async def chat_booking(chat: ChatMessage, current_user = Depends(get_current_use
                         new_time = datetime.strptime(new_time, "%I:%M %p").strftime("%H:%M:%S")
 
                     # [FIX] Ensure cursor is clean before validation check
-                    cursor.execute("SELECT id FROM appointments WHERE id = %s AND student_id = %s", (appt_id, current_user['user_id']))
-                    if not cursor.fetchone():
+                    cursor.execute("SELECT id, service_type, status, appointment_date FROM appointments WHERE id = %s AND student_id = %s", (appt_id, current_user['user_id']))
+                    existing = cursor.fetchone()
+                    if not existing:
                         cursor.close(); conn.close()
                         return {"response": f"I can't find Appointment #{appt_id}."}
                     
                     # Consume any remaining result to prevent 'Unread result' error
                     cursor.fetchall() 
 
-                    err = validate_booking_rules(cursor, new_date, new_time)
+                    err = validate_booking_rules(cursor, new_date, new_time, existing['service_type'], existing['id'])
                     if err: return {"response": f"Can't reschedule: {err}"}
 
                     cursor.execute("UPDATE appointments SET appointment_date = %s, appointment_time = %s, status = 'pending', updated_at = NOW() WHERE id = %s", (new_date, new_time, appt_id))
                     conn.commit()
+                    triage_queue.remove(existing['id'])
+                    if existing['status'] in ACTIVE_STATUSES: offer_freed_slots(conn, existing['appointment_date'])
                     # [FIX] Added refresh flag
                     return {"response": f"Rescheduled Appointment #{appt_id} to {new_date}!", "refresh": True}
 
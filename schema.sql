@@ -26,7 +26,7 @@ CREATE TABLE appointments (
     reason TEXT NOT NULL,
     
     booking_mode ENUM('standard', 'ai_chatbot') DEFAULT 'standard',
-    status ENUM('pending', 'approved', 'rejected', 'canceled', 'completed') DEFAULT 'pending',
+    status ENUM('pending', 'approved', 'rejected', 'canceled', 'completed', 'noshow') DEFAULT 'pending',
     admin_note TEXT,
     
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
@@ -54,4 +54,118 @@ CREATE TABLE notifications (
     is_read BOOLEAN DEFAULT FALSE,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (student_id) REFERENCES users(id) ON DELETE CASCADE
-);
\ No newline at end of file
+);
+
+-- 4. Schedule Engine Tables
+-- Weekly shifts (weekday: 0 = Monday ... 6 = Sunday). No rows for a weekday = closed.
+-- Several rows per weekday allow breaks (e.g. lunch) and overlapping nurse shifts.
+CREATE TABLE clinic_hours (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    weekday TINYINT NOT NULL,
+    start_time TIME NOT NULL,
+    end_time TIME NOT NULL,
+    staff_count INT NOT NULL DEFAULT 1
+);
+
+-- Holidays and other whole-day closures
+CREATE TABLE clinic_closures (
+    closure_date DATE PRIMARY KEY,
+    reason VARCHAR(255) NOT NULL DEFAULT 'Holiday'
+);
+
+-- How long each service blocks a nurse
+CREATE TABLE service_durations (
+    service_type VARCHAR(100) PRIMARY KEY,
+    duration_minutes INT NOT NULL
+);
+
+INSERT INTO clinic_hours (weekday, start_time, end_time, staff_count) VALUES
+    (0, '08:00:00', '12:00:00', 1), (0, '13:00:00', '17:00:00', 1),
+    (1, '08:00:00', '12:00:00', 1), (1, '13:00:00', '17:00:00', 1),
+    (2, '08:00:00', '12:00:00', 1), (2, '13:00:00', '17:00:00', 1),
+    (3, '08:00:00', '12:00:00', 1), (3, '13:00:00', '17:00:00', 1),
+    (4, '08:00:00', '12:00:00', 1), (4, '13:00:00', '17:00:00', 1),
+    (5, '08:00:00', '12:00:00', 1), (5, '13:00:00', '17:00:00', 1);
+
+INSERT INTO service_durations (service_type, duration_minutes) VALUES
+    ('Medical Consultation', 60),
+    ('Medical Clearance', 30);
+
+-- 5. Archive Tables (hot/cold split)
+-- Closed appointments older than ARCHIVE_HORIZON_DAYS are moved here in small
+-- batches by the archive job in main.py. Columns mirror the hot tables.
+CREATE TABLE appointments_archive (
+    id INT PRIMARY KEY,
+    student_id INT NOT NULL,
+    service_type VARCHAR(100) NOT NULL,
+    urgency ENUM('Normal', 'Urgent') DEFAULT 'Normal',
+    appointment_date DATE NOT NULL,
+    appointment_time TIME NOT NULL,
+    reason TEXT NOT NULL,
+    booking_mode ENUM('standard', 'ai_chatbot') DEFAULT 'standard',
+    status VARCHAR(20) NOT NULL,
+    admin_note TEXT,
+    created_at TIMESTAMP NULL,
+    updated_at TIMESTAMP NULL,
+    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_archive_student_date (student_id, appointment_date),
+    INDEX idx_archive_date (appointment_date),
+    FOREIGN KEY (student_id) REFERENCES users(id) ON DELETE CASCADE
+);
+
+CREATE TABLE chat_history_archive (
+    id INT PRIMARY KEY,
+    student_id INT NOT NULL,
+    message TEXT NOT NULL,
+    sender ENUM('user', 'bot') NOT NULL,
+    appointment_id INT,
+    created_at TIMESTAMP NULL,
+    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_chat_archive_appointment (appointment_id),
+    FOREIGN KEY (student_id) REFERENCES users(id) ON DELETE CASCADE
+);
+
+-- Serves the hot-path lookups (date + active status) and the archive job's scan
+CREATE INDEX idx_appointments_date_status ON appointments (appointment_date, status);
+-- Serves the day-end sweep (status IN (...) AND appointment_date < today) and the queue reload
+CREATE INDEX idx_appointments_status_date ON appointments (status, appointment_date);
+CREATE INDEX idx_chat_history_created ON chat_history (created_at);
+
+-- 6. Shared Rate Limit Buckets (only used when RATE_LIMIT_BACKEND=mysql)
+CREATE TABLE rate_limit_buckets (
+    bucket_key VARCHAR(128) PRIMARY KEY,
+    tokens DOUBLE NOT NULL,
+    updated_at DOUBLE NOT NULL
+);
+
+-- 7. Triage Queue Claims
+-- A nurse claims a queue item before acting on it; shared by all workers.
+CREATE TABLE queue_leases (
+    appointment_id INT PRIMARY KEY,
+    user_id INT NOT NULL,
+    full_name VARCHAR(255) NOT NULL,
+    expires_at DATETIME NOT NULL,
+    FOREIGN KEY (appointment_id) REFERENCES appointments(id) ON DELETE CASCADE
+);
+
+-- 8. Waitlist (slot backfill on cancellations)
+-- start_time/end_time NULL = any time that day. While status = 'offered' the
+-- slot at offered_time is held for the student until offer_expires_at.
+CREATE TABLE waitlist (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    student_id INT NOT NULL,
+    window_date DATE NOT NULL,
+    start_time TIME NULL,
+    end_time TIME NULL,
+    service_type VARCHAR(100) NOT NULL,
+    urgency ENUM('Normal', 'Urgent') DEFAULT 'Normal',
+    reason TEXT NOT NULL,
+    status ENUM('waiting', 'offered', 'booked', 'expired', 'canceled') DEFAULT 'waiting',
+    offered_time TIME NULL,
+    offer_expires_at DATETIME NULL,
+    queued_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,  -- place in line, reset when an offer is declined
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_waitlist_date_status (window_date, status, queued_at),
+    INDEX idx_waitlist_student (student_id, status),
+    FOREIGN KEY (student_id) REFERENCES users(id) ON DELETE CASCADE
+);
@@ -140,6 +140,7 @@ async function loadAppointments() {
                 'Authorization': `Bearer ${token}`
             }
         });
+        if (!response.ok) return; // keep the last list (e.g. when rate limited)
         
         allAppointments = await response.json();
 
@@ -325,6 +326,11 @@ async function sendChatMessage() {
         // Remove typing before showing answer
         removeTypingIndicator();
 
+        if (!response.ok) {
+            addChatMessage('bot', data.detail || 'Sorry, I encountered an error. Please try again.');
+            return;
+        }
+
         chatHistory.push({ role: "model", message: data.response });
         addChatMessage('bot', data.response);
         
@@ -364,6 +370,7 @@ function toggleSidebar() {
 // 1. Function to load slots from the backend
 async function loadTimeSlots() {
     const date = document.getElementById('book-date').value;
+    const serviceType = document.getElementById('book-type').value;
     const container = document.getElementById('slots-container');
     const timeInput = document.getElementById('selected-time');
     
@@ -374,15 +381,23 @@ async function loadTimeSlots() {
     container.innerHTML = '<p style="font-size:0.9rem; color:#666;">Checking availability...</p>';
 
     try {
-        const response = await fetch(`${API_URL}/slots?date=${date}`, {
+        const response = await fetch(`${API_URL}/slots?date=${date}&service_type=${encodeURIComponent(serviceType || '')}`, {
             headers: { 'Authorization': `Bearer ${token}` }
         });
         const slots = await response.json();
+
+        if (!response.ok) {
+            container.innerHTML = `<p style="color:red; font-size:0.9rem;">${slots.detail || 'Error loading slots.'}</p>`;
+            return;
+        }
         
         container.innerHTML = ''; 
 
         if(slots.length === 0) {
-            container.innerHTML = '<p style="color:red; font-size:0.9rem;">Full for this day. Please choose another date.</p>';
+            container.innerHTML = `
+                <p style="color:red; font-size:0.9rem;">Full for this day. Please choose another date.</p>
+                <div class="slot-btn" onclick="joinWaitlist('${date}')"><i class="fas fa-bell"></i> Notify me if a slot opens</div>
+            `;
             return;
         }
 
@@ -427,6 +442,7 @@ function closeRescheduleModal() {
 
 async function loadRescheduleSlots() {
     const date = document.getElementById('reschedule-date').value;
+    const apt = allAppointments.find(a => a.id == document.getElementById('reschedule-id').value);
     const container = document.getElementById('reschedule-slots');
     const timeInput = document.getElementById('reschedule-time');
 
@@ -435,10 +451,16 @@ async function loadRescheduleSlots() {
     container.innerHTML = '<p>Loading...</p>';
     
     try {
-        const response = await fetch(`${API_URL}/slots?date=${date}`, {
+        const serviceType = apt ? apt.service_type : '';
+        const response = await fetch(`${API_URL}/slots?date=${date}&service_type=${encodeURIComponent(serviceType)}`, {
             headers: { 'Authorization': `Bearer ${token}` }
         });
         const slots = await response.json();
+
+        if (!response.ok) {
+            container.innerHTML = `<p style="color:red">${slots.detail || 'Error loading slots.'}</p>`;
+            return;
+        }
         
         container.innerHTML = '';
         if(slots.length === 0) {
@@ -571,8 +593,85 @@ function generateTicket(apt) {
     }, 500); 
 }
 
+// --- WAITLIST LOGIC ---
+// When a day is full the student joins the waitlist; the server puts a freed
+// slot on hold for them and we just check for offers.
+
+let shownOffers = new Set();
+
+async function joinWaitlist(date) {
+    const serviceType = document.getElementById('book-type').value;
+    const urgency = document.getElementById('book-urgency').value;
+    const reason = document.getElementById('book-reason').value;
+
+    if (!serviceType || !reason) {
+        Swal.fire('Missing Details', 'Please choose a service and enter a reason first.', 'warning');
+        return;
+    }
+
+    try {
+        const response = await fetch(`${API_URL}/waitlist`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json', 'Authorization': `Bearer ${token}` },
+            body: JSON.stringify({ date: date, service_type: serviceType, urgency: urgency || 'Normal', reason: reason })
+        });
+        const data = await response.json();
+        if (!response.ok) {
+            Swal.fire('Waitlist', data.detail || 'Could not join the waitlist.', 'error');
+            return;
+        }
+        Swal.fire('On the Waitlist', "We'll hold the next free slot for you and let you know here.", 'success');
+        loadWaitlistOffers();
+    } catch (e) { console.error(e); }
+}
+
+async function loadWaitlistOffers() {
+    try {
+        const response = await fetch(`${API_URL}/waitlist`, { headers: { 'Authorization': `Bearer ${token}` } });
+        if (!response.ok) return;
+        const entries = await response.json();
+
+        // the same entry can get a new offer after a skip, so key on the offer itself
+        const offerKey = e => `${e.id}-${e.offered_time}-${e.offer_expires_at}`;
+        const offer = entries.find(e => e.status === 'offered' && !shownOffers.has(offerKey(e)));
+        if (!offer || Swal.isVisible()) return;
+        shownOffers.add(offerKey(offer));
+
+        const result = await Swal.fire({
+            icon: 'info',
+            title: 'A slot opened up!',
+            html: `<strong>${offer.date}</strong> at <strong>${formatTime(offer.offered_time)}</strong> is being held for you until ${formatTime(offer.offer_expires_at.split('T')[1])}.<br><br>
+                   <small>"Skip this time" keeps you on the waitlist for another opening. "Leave waitlist" removes your request for this day.</small>`,
+            showDenyButton: true,
+            showCancelButton: true,
+            confirmButtonColor: '#1E88E5',
+            denyButtonColor: '#607d8b',
+            confirmButtonText: 'Book it',
+            denyButtonText: 'Skip this time',
+            cancelButtonText: 'Leave waitlist'
+        });
+
+        if (result.isConfirmed) {
+            const res = await fetch(`${API_URL}/waitlist/${offer.id}/accept`, { method: 'POST', headers: { 'Authorization': `Bearer ${token}` } });
+            const data = await res.json();
+            if (res.ok) {
+                Swal.fire('Booked!', 'Your appointment has been scheduled.', 'success');
+                loadAppointments();
+            } else {
+                Swal.fire('Sorry', data.detail || 'This offer is no longer available.', 'error');
+            }
+        } else if (result.isDenied) {
+            await fetch(`${API_URL}/waitlist/${offer.id}/decline`, { method: 'POST', headers: { 'Authorization': `Bearer ${token}` } });
+        } else if (result.dismiss === Swal.DismissReason.cancel) {
+            await fetch(`${API_URL}/waitlist/${offer.id}`, { method: 'DELETE', headers: { 'Authorization': `Bearer ${token}` } });
+        }
+    } catch (e) { console.error(e); }
+}
+
 // Initialize
 loadAppointments();
+loadWaitlistOffers();
 
 // Auto-refresh data every 2 seconds
-setInterval(loadAppointments, 2000);
\ No newline at end of file
+setInterval(loadAppointments, 2000);
+setInterval(loadWaitlistOffers, 10000);
\ No newline at end of file
@@ -0,0 +1,84 @@
+import threading
+import time
+
+import pytest
+
+import main
+
+
+def test_refill_bucket_spends_a_token_when_available():
+    allowed, tokens, retry_after = main.refill_bucket(3, 100.0, 100.0, 1.0, 5)
+    assert allowed
+    assert tokens == 2
+    assert retry_after == 0
+
+
+def test_refill_bucket_refills_up_to_burst():
+    allowed, tokens, _ = main.refill_bucket(0, 0.0, 1000.0, 1.0, 5)
+    assert allowed
+    assert tokens == 4
+
+
+def test_refill_bucket_reports_wait_when_empty():
+    allowed, tokens, retry_after = main.refill_bucket(0.5, 100.0, 100.0, 0.2, 5)
+    assert not allowed
+    assert tokens == 0.5
+    assert retry_after == pytest.approx(2.5)
+
+
+def test_single_flight_shares_one_computation():
+    flights = main.SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    calls, results = [], []
+
+    def slow():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return 'rows'
+
+    leader = threading.Thread(target=lambda: results.append(flights.do('key', slow)))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(flights.do('key', slow))) for _ in range(3)]
+    for t in followers:
+        t.start()
+    time.sleep(0.1)  # let the followers reach the in-flight call
+    release.set()
+    for t in [leader] + followers:
+        t.join(5)
+
+    assert results == ['rows'] * 4
+    assert len(calls) == 1
+    assert flights.calls == {}
+
+
+def test_single_flight_followers_get_the_leader_error():
+    flights = main.SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    errors = []
+
+    def failing():
+        started.set()
+        release.wait(5)
+        raise ValueError('db down')
+
+    def call(fn):
+        try:
+            flights.do('key', fn)
+        except ValueError as e:
+            errors.append(str(e))
+
+    threads = [threading.Thread(target=call, args=(failing,))]
+    threads[0].start()
+    started.wait(5)
+    # the follower's own function would succeed, so an error here came from the leader
+    threads.append(threading.Thread(target=call, args=(lambda: 'rows',)))
+    threads[1].start()
+    time.sleep(0.1)
+    release.set()
+    for t in threads:
+        t.join(5)
+
+    assert errors == ['db down', 'db down']
+    assert flights.calls == {}
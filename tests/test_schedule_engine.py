@@ -0,0 +1,81 @@
+from datetime import date, timedelta
+
+import main
+
+
+def make_config(shifts, closures=None):
+    hours = {}
+    for weekday, start, end, staff in shifts:
+        hours.setdefault(weekday, []).append((start, end, staff))
+    return {'hours': hours, 'closures': closures or {}, 'durations': dict(main.DEFAULT_SERVICE_DURATIONS)}
+
+
+def load_for(*visits):
+    load = [0] * main.MINUTES_PER_DAY
+    for start, minutes in visits:
+        for m in range(start, start + minutes):
+            load[m] += 1
+    return load
+
+
+class FakeCursor:
+    # hands out one prepared result set per execute()
+    def __init__(self, *results):
+        self.results = list(results)
+
+    def execute(self, query, params=None):
+        self.rows = self.results.pop(0)
+
+    def fetchall(self):
+        return list(self.rows)
+
+
+MONDAY = date(2030, 1, 7)
+
+
+def setup_function():
+    main._capacity_cache.clear()
+
+
+def test_default_hours_keep_last_slot_before_break():
+    capacity = main.get_capacity_vector(make_config(main.DEFAULT_CLINIC_HOURS), MONDAY)
+    load = load_for()
+    assert main.slot_is_free(capacity, load, 11 * 60 + 30, 60)
+    assert main.slot_is_free(capacity, load, 16 * 60 + 30, 60)
+    assert not main.slot_is_free(capacity, load, 12 * 60, 30)
+
+
+def test_overlapping_shifts_do_not_overbook():
+    # two nurses 10:00-12:00, only one from 12:00 to 14:00
+    config = make_config([(0, 8 * 60, 12 * 60, 1), (0, 10 * 60, 14 * 60, 1)])
+    capacity = main.get_capacity_vector(config, MONDAY)
+    load = load_for((12 * 60, 60))
+    assert not main.slot_is_free(capacity, load, 11 * 60 + 30, 60)
+    assert main.slot_is_free(capacity, load, 10 * 60, 60)
+
+
+def test_capacity_above_one_allows_parallel_visits():
+    config = make_config([(0, 8 * 60, 12 * 60, 2)])
+    capacity = main.get_capacity_vector(config, MONDAY)
+    assert main.slot_is_free(capacity, load_for((9 * 60, 60)), 9 * 60, 60)
+    assert not main.slot_is_free(capacity, load_for((9 * 60, 60), (9 * 60 + 30, 60)), 9 * 60, 60)
+
+
+def test_closures_and_closed_days_have_no_capacity():
+    config = make_config(main.DEFAULT_CLINIC_HOURS, closures={MONDAY: 'Holiday'})
+    assert not any(main.get_capacity_vector(config, MONDAY))
+    assert not any(main.get_capacity_vector(make_config(main.DEFAULT_CLINIC_HOURS), date(2030, 1, 6)))
+
+
+def test_load_vector_counts_waitlist_holds_with_or_without_exclude_id():
+    config = make_config(main.DEFAULT_CLINIC_HOURS)
+    booked = [{'id': 5, 'appointment_time': timedelta(hours=10), 'service_type': None}]
+    hold = [{'id': None, 'appointment_time': timedelta(hours=9), 'service_type': None}]
+
+    load = main.get_load_vector(FakeCursor(booked, hold), config, str(MONDAY))
+    assert load[9 * 60] == 1
+    assert load[10 * 60] == 1
+
+    load = main.get_load_vector(FakeCursor(booked, hold), config, str(MONDAY), exclude_id=5)
+    assert load[9 * 60] == 1
+    assert load[10 * 60] == 0